@@ -27,15 +27,19 @@ from .transformer import Transformer
 from . import message
 
 
-def doc_main(args):
-    logger = message.MessageLogger.get(namespace=None)
-    logger.enable_warnings((message.WARNING, message.ERROR, message.FATAL))
+_option_parser = None
+
+
+def _get_option_parser():
+    global _option_parser
+    if _option_parser is not None:
+        return _option_parser
 
     parser = argparse.ArgumentParser()
 
     parser.add_argument("girfile")
     parser.add_argument("-o", "--output",
-                      action="store", dest="output",
+                      action="store", dest="output", required=True,
                       help="Directory to write output to")
     parser.add_argument("-l", "--language",
                       action="store", dest="language",
@@ -70,12 +74,18 @@ def doc_main(args):
                       "a GList' will resolve the existing GList type and "
                       "insert a link to its documentation")
 
-    args = parser.parse_args(args[1:])
-    if not args.output:
-        raise SystemExit("missing output parameter")
+    _option_parser = parser
+    return parser
+
 
-    if 'UNINSTALLED_INTROSPECTION_SRCDIR' in os.environ:
-        top_srcdir = os.environ['UNINSTALLED_INTROSPECTION_SRCDIR']
+def doc_main(args):
+    logger = message.MessageLogger.get(namespace=None)
+    logger.enable_warnings((message.WARNING, message.ERROR, message.FATAL))
+
+    args = _get_option_parser().parse_args(args[1:])
+
+    top_srcdir = os.environ.get('UNINSTALLED_INTROSPECTION_SRCDIR')
+    if top_srcdir is not None:
         top_builddir = os.environ['UNINSTALLED_INTROSPECTION_BUILDDIR']
         extra_include_dirs = [os.path.join(top_srcdir, 'gir'), top_builddir]
     else:
@@ -84,11 +94,8 @@ def doc_main(args):
     transformer = Transformer.parse_from_gir(args.girfile, extra_include_dirs)
 
     if args.write_sections:
-        sections_file = generate_sections_file(transformer)
-
-        fp = open(args.output, 'w')
-        write_sections_file(fp, sections_file)
-        fp.close()
+        with open(args.output, 'w') as fp:
+            write_sections_file(fp, generate_sections_file(transformer))
     else:
         writer = DocWriter(transformer, args.language,
                 args.markdown_include_paths, online=args.online_links,
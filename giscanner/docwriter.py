@@ -21,17 +21,21 @@
 # 02110-1301, USA.
 #
 
+import codecs
+import hashlib
 import os
 import re
+import shutil
 import tempfile
 
 from xml.sax import saxutils
 from xml.etree import ElementTree as ET
 from mako.lookup import TemplateLookup
+from mako.runtime import Context
 
 from . import message
 from . import ast, xmlwriter
-from .utils import to_underscores, indent
+from .utils import to_underscores
 
 # Freely inspired from
 # https://github.com/GNOME/yelp-xsl/blob/master/js/syntax.html
@@ -57,6 +61,54 @@ language_mimes = {
     "yaml": "application/x-yaml",
 }
 
+_CAMEL_CASE_WORD_RE = re.compile(r'(.)([A-Z][a-z]+)')
+_CAMEL_CASE_BOUNDARY_RE = re.compile(r'([a-z0-9])([A-Z])')
+_IMPLICIT_LINK_SPLIT_RE = re.compile(r'([ ()])')
+_XML_SPECIAL_CHARS_RE = re.compile(r'[&<>]')
+# Characters any of the DocstringScanner tokens starts with or, for
+# function calls, contains.
+_DOC_MARKUP_CHARS_RE = re.compile(r'[\n|\]#%@{(]')
+
+
+# Page and gtk-doc ids are requested over and over for the same nodes,
+# and computing them walks up the whole parent chain. The caches are keyed
+# on the identity of the node and of its parent, and the entries keep both
+# alive so that their id() cannot be recycled while cached.
+_page_id_cache = {}
+_gtkdoc_id_cache = {}
+
+
+def clear_id_caches():
+    _page_id_cache.clear()
+    _gtkdoc_id_cache.clear()
+
+
+def _intern(string):
+    # The ids are used over and over as dictionary keys and link targets.
+    # intern() only accepts byte strings.
+    if type(string) is str:
+        return intern(string)
+    return string
+
+
+def _qname(node):
+    # The namespace qualified name of a node, used as the key of the class
+    # hierarchies and the implementations index.
+    try:
+        return node._doc_qname
+    except AttributeError:
+        pass
+
+    qname = _intern('%s.%s' % (node.namespace.name, node.name))
+    node._doc_qname = qname
+    return qname
+
+
+def _get_parent(node):
+    if hasattr(node, '_chain') and node._chain:
+        return node._chain[-1]
+    return getattr(node, 'parent', None)
+
 
 def make_page_id(node, recursive=False):
     if isinstance(node, ast.Namespace):
@@ -65,11 +117,19 @@ def make_page_id(node, recursive=False):
         else:
             return 'index'
 
-    if hasattr(node, '_chain') and node._chain:
-        parent = node._chain[-1]
-    else:
-        parent = getattr(node, 'parent', None)
+    parent = _get_parent(node)
+    key = (id(node), id(parent))
+    try:
+        return _page_id_cache[key][-1]
+    except KeyError:
+        pass
 
+    page_id = _intern(_make_page_id(node, parent))
+    _page_id_cache[key] = (node, parent, page_id)
+    return page_id
+
+
+def _make_page_id(node, parent):
     if parent is None:
         if isinstance(node, ast.Function) and node.shadows:
             return '%s.%s' % (node.namespace.name, node.shadows)
@@ -84,32 +144,41 @@ def make_page_id(node, recursive=False):
         return '%s.%s' % (make_page_id(parent, recursive=True), node.name)
 
 
-def make_gtkdoc_id(node, separator=None, formatter=None):
-    def class_style(name):
-        return name
+def _gtkdoc_class_style(name):
+    return name
+
 
-    def function_style(name):
-        snake_case = re.sub('(.)([A-Z][a-z]+)', r'\1_\2',
-                name)
-        snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', snake_case).lower()
-        return snake_case.replace("_", "-")
+def _gtkdoc_function_style(name):
+    snake_case = _CAMEL_CASE_WORD_RE.sub(r'\1_\2', name)
+    snake_case = _CAMEL_CASE_BOUNDARY_RE.sub(r'\1_\2', snake_case).lower()
+    return snake_case.replace("_", "-")
 
+
+def make_gtkdoc_id(node, separator=None, formatter=None):
     if separator is None:
         separator = "-"
-        formatter = function_style
+        formatter = _gtkdoc_function_style
         if isinstance(node, (ast.Class, ast.Enum, ast.Record, ast.Interface,
                              ast.Callback, ast.Alias)):
             separator = ""
-            formatter = class_style
+            formatter = _gtkdoc_class_style
 
     if isinstance(node, ast.Namespace):
         return formatter(node.identifier_prefixes[0])
 
-    if hasattr(node, '_chain') and node._chain:
-        parent = node._chain[-1]
-    else:
-        parent = getattr(node, 'parent', None)
+    parent = _get_parent(node)
+    key = (id(node), id(parent), separator, formatter)
+    try:
+        return _gtkdoc_id_cache[key][-1]
+    except KeyError:
+        pass
+
+    gtkdoc_id = _intern(_make_gtkdoc_id(node, parent, separator, formatter))
+    _gtkdoc_id_cache[key] = (node, parent, gtkdoc_id)
+    return gtkdoc_id
 
+
+def _make_gtkdoc_id(node, parent, separator, formatter):
     if parent is None:
         if isinstance(node, ast.Function) and node.shadows:
             return '%s%s%s' % (formatter(node.namespace.name), separator,
@@ -127,6 +196,42 @@ def make_gtkdoc_id(node, separator=None, formatter=None):
 
 
 def get_node_kind(node):
+    # The kind of a node is asked for every time it is rendered or linked,
+    # compute it once and keep it on the node.
+    try:
+        return node._doc_kind
+    except AttributeError:
+        pass
+
+    node_kind = _compute_node_kind(node)
+    node._doc_kind = node_kind
+    return node_kind
+
+
+# Node types whose kind doesn't depend on the node itself. Note that
+# records and unions are compounds and so rendered as classes.
+_NODE_KIND_BY_TYPE = {
+    ast.Namespace: 'namespace',
+    ast.Class: 'class',
+    ast.Boxed: 'class',
+    ast.Compound: 'class',
+    ast.Record: 'class',
+    ast.Union: 'class',
+    ast.Interface: 'interface',
+    ast.Enum: 'enum',
+    ast.Bitfield: 'enum',
+    ast.Callback: 'callback',
+    ast.Field: 'field',
+    ast.DocSection: 'docsection',
+}
+
+
+def _compute_node_kind(node):
+    try:
+        return _NODE_KIND_BY_TYPE[type(node)]
+    except KeyError:
+        pass
+
     if isinstance(node, ast.Namespace):
         node_kind = 'namespace'
     elif isinstance(node, (ast.Class, ast.Boxed, ast.Compound)):
@@ -164,12 +269,16 @@ def get_node_kind(node):
 
 class TemplatedScanner(object):
     def __init__(self, specs):
+        # Maps the name of each spec to the (key, group name) pairs of the
+        # named sub-patterns it contains, filled by unmangle_specs()
+        self._subgroups = {}
         self.specs = self.unmangle_specs(specs)
         self.regex = self.make_regex(self.specs)
 
     def unmangle_specs(self, specs):
         mangled = re.compile('<<([a-zA-Z_:]+)>>')
         specdict = dict((name.lstrip('!'), spec) for name, spec in specs)
+        subgroups = self._subgroups
 
         def unmangle(spec, name=None):
             def replace_func(match):
@@ -184,7 +293,9 @@ class TemplatedScanner(object):
                 # Force all child specs of this one to be unnamed
                 unmangled = unmangle(child_spec, None)
                 if pattern_name and name:
-                    return '(?P<%s_%s>%s)' % (name, pattern_name, unmangled)
+                    group = '%s_%s' % (name, pattern_name)
+                    subgroups.setdefault(name, []).append((pattern_name, group))
+                    return '(?P<%s>%s)' % (group, unmangled)
                 else:
                     return unmangled
 
@@ -198,22 +309,14 @@ class TemplatedScanner(object):
         return re.compile(regex)
 
     def get_properties(self, name, match):
-        groupdict = match.groupdict()
-        properties = {name: groupdict.pop(name)}
-        name = name + "_"
-        for group, value in groupdict.iteritems():
-            if group.startswith(name):
-                key = group[len(name):]
-                properties[key] = value
+        properties = {name: match.group(name)}
+        for key, group in self._subgroups.get(name, ()):
+            properties[key] = match.group(group)
         return properties
 
     def scan(self, text):
         pos = 0
-        while True:
-            match = self.regex.search(text, pos)
-            if match is None:
-                break
-
+        for match in self.regex.finditer(text):
             start = match.start()
             if start > pos:
                 yield ('other', text[pos:start], None)
@@ -244,7 +347,7 @@ class DocstringScanner(TemplatedScanner):
             ('type_name', r'#(<<type_name:alpha>>)'),
             ('enum_value', r'%(<<member_name:alpha>>)'),
             ('parameter', r'@<<param_name:alpha>>'),
-            ('function_call', r'<<symbol_name:alpha>>\(\)'),
+            ('function_call', r'\b<<symbol_name:alpha>>\(\)'),
             ('include', r'{{\s*<<include_name:anything>>\s*}}'),
             ('heading', r'#+\s+<<heading:anything>>'),
         ]
@@ -252,7 +355,9 @@ class DocstringScanner(TemplatedScanner):
         super(DocstringScanner, self).__init__(specs)
 
 
-class HierarchyClass:
+class HierarchyClass(object):
+
+    __slots__ = ('parents', 'children', 'name', 'node')
 
     def __init__(self, name, node=None):
         self.parents = []
@@ -268,28 +373,28 @@ class HierarchyClass:
         self.children.append(child)
 
 
-class Section:
+class Section(object):
+
+    __slots__ = ('subsections', 'symbols', 'name', 'next_section')
 
     def __init__(self, name, node, global_table):
         self.subsections = {}
         self.symbols = {}
         self.name = name
         self.next_section = None
-        prev_node = None
-        for n in node.find("SYMBOLS"):
-            title = n.text
-            symbol = Symbol(title)
-            if prev_node:
-                prev_node.set_next(symbol)
-            self.symbols[title] = symbol
-            prev_node = symbol
-            global_table[title] = symbol
+        symbols = [Symbol(n.text) for n in node.find("SYMBOLS")]
+        for symbol, next_symbol in zip(symbols, symbols[1:]):
+            symbol.set_next(next_symbol)
+        self.symbols.update((symbol.name, symbol) for symbol in symbols)
+        global_table.update(self.symbols)
 
     def set_next(self, section):
         self.next_section = section
 
 
-class Symbol:
+class Symbol(object):
+
+    __slots__ = ('name', 'next_')
 
     def __init__(self, name):
         self.name = name
@@ -307,6 +412,23 @@ class DocFormatter(object):
         self.resolve_implicit_links = resolve_implicit_links
         self._transformer = transformer
         self._scanner = DocstringScanner()
+        self._dispatch = {
+            'other': self._process_other,
+            'property': self._process_property,
+            'signal': self._process_signal,
+            'type_name': self._process_type_name,
+            'enum_value': self._process_enum_value,
+            'parameter': self._process_parameter,
+            'function_call': self._process_function_call,
+            'code_start': self._process_code_start,
+            'code_start_with_language': self._process_code_start_with_language,
+            'code_end': self._process_code_end,
+            'new_line': self._process_new_line,
+            'new_paragraph': self._process_new_paragraph,
+            'include': self._process_include,
+            'note': self._process_note,
+            'heading': self._process_heading,
+        }
         self.global_symbols_table = {}
         self.sections = self._parse_sections_file(sections_file)
 
@@ -323,6 +445,20 @@ class DocFormatter(object):
         self._warned_external_references = []
         # Support Headings
         self._opened_sections = 0
+        # Nodes resolved from the words of the documentation when looking
+        # for implicit links, None for words that don't resolve
+        self._identifier_cache = {}
+        # Formatted links and types, keyed on the id of the node or type
+        # and the formatting options. The entries keep the node or type
+        # alive so that its id cannot be reused.
+        self._xref_cache = {}
+        self._type_cache = {}
+        # Nodes looked up for types, keyed on the type id
+        self._typenode_cache = {}
+        # Classes implementing each interface, per namespace
+        self._implementations = {}
+        # Direct parents of the classes in the class hierarchies
+        self._hierarchy_parents = {}
 
     def _parse_sections_file(self, sections_file):
         if not sections_file:
@@ -341,32 +477,50 @@ class DocFormatter(object):
         return sections
 
     def _fill_reference_map(self, online):
-        if not os.path.exists(os.path.join(DATADIR, "gtk-doc", "html")):
+        html_dir = os.path.join(DATADIR, "gtk-doc", "html")
+        try:
+            packages = os.listdir(html_dir)
+        except OSError:
             return
 
-        for node in os.listdir(os.path.join(DATADIR, "gtk-doc", "html")):
-            dir_ = os.path.join(DATADIR, "gtk-doc/html", node)
+        for package in packages:
+            dir_ = html_dir + os.sep + package
             if os.path.isdir(dir_):
                 try:
                     online_reference, symbol_map = self._parse_sgml_index(dir_)
-                    self._reference_map[node] = (dir_, online_reference,
+                    self._reference_map[package] = (dir_, online_reference,
                             symbol_map)
                 except IOError:
-                    online_reference = None
+                    pass
 
     def _parse_sgml_index(self, dir_):
         online_reference = None
         symbol_map = dict({})
-        with open(os.path.join(dir_, "index.sgml"), 'r') as f:
+        # Read the index as bytes, there is no need for newline
+        # translation and most of the lines are anchors.
+        with open(os.path.join(dir_, "index.sgml"), 'rb') as f:
             for l in f:
-                if l.startswith("<ONLINE"):
-                    online_reference = l.split('"')[1]
-                elif l.startswith("<ANCHOR"):
+                if l.startswith("<ANCHOR"):
                     split_line = l.split('"')
                     symbol_map[split_line[1]] = split_line[3]
+                elif l.startswith("<ONLINE"):
+                    online_reference = l.split('"')[1]
         return online_reference, symbol_map
 
+    def _lookup_typenode(self, type_):
+        try:
+            return self._typenode_cache[id(type_)][-1]
+        except KeyError:
+            pass
+
+        node = self._transformer.lookup_typenode(type_)
+        self._typenode_cache[id(type_)] = (type_, node)
+        return node
+
     def escape(self, text):
+        # Most of the documentation text doesn't need escaping at all
+        if _XML_SPECIAL_CHARS_RE.search(text) is None:
+            return text
         return saxutils.escape(text)
 
     def should_render_node(self, node):
@@ -387,19 +541,19 @@ class DocFormatter(object):
         if doc is None:
             return ''
 
-        result = ""
+        result = []
         processing_code = self._processing_code
 
         if not processing_code:
-            result += '<p>'
-        result += self.format_inline(node, doc)
+            result.append('<p>')
+        result.append(self.format_inline(node, doc))
         if not processing_code:
-            result += '</p>'
+            result.append('</p>')
 
-        while self._opened_sections > 0:
-            result += "</section>"
-            self._opened_sections -= 1
-        return result
+        if self._opened_sections > 0:
+            result.append("</section>" * self._opened_sections)
+            self._opened_sections = 0
+        return ''.join(result)
 
     def format_xref_from_identifier(self, identifier):
         result = ""
@@ -419,9 +573,8 @@ class DocFormatter(object):
                 symbol = self.global_symbols_table[node.symbol]
                 next_symbol = symbol.next_
                 if symbol.next_:
-                    result = '<link xref="'
-                    result += self.format_xref_from_identifier(symbol.next_.name)
-                    result += '" type="next"/>'
+                    result = '<link xref="%s" type="next"/>' % (
+                        self.format_xref_from_identifier(symbol.next_.name), )
             except KeyError:  # Class functions
                 pass
         elif self.sections:
@@ -430,9 +583,8 @@ class DocFormatter(object):
                     section = self.sections[node.gtype_name]
                     next_section = section.next_section
                     if next_section:
-                        result = '<link xref="'
-                        result += self.format_xref_from_identifier(next_section.name)
-                        result += '" type="next"/>'
+                        result = '<link xref="%s" type="next"/>' % (
+                            self.format_xref_from_identifier(next_section.name), )
                 except KeyError:
                     pass
             elif isinstance(node, (ast.DocSection)):
@@ -440,9 +592,8 @@ class DocFormatter(object):
                     section = self.sections[node.name]
                     next_section = section.next_section
                     if next_section:
-                        result = '<link xref="'
-                        result += self.format_xref_from_identifier(next_section.name)
-                        result += '" type="next"/>'
+                        result = '<link xref="%s" type="next"/>' % (
+                            self.format_xref_from_identifier(next_section.name), )
                 except KeyError:
                     pass
 
@@ -478,33 +629,58 @@ class DocFormatter(object):
                     return node
         return None
 
-    def _find_thing(self, list_, name):
-        for item in list_:
-            if item.name == name:
-                return item
-        raise KeyError("Could not find %s" % (name, ))
+    def _get_type_members(self, type_node):
+        # Index the properties and signals of a type by name in a single
+        # sweep, the first time the type is referenced. The first member
+        # with a given name wins.
+        try:
+            return type_node._doc_members
+        except AttributeError:
+            pass
+
+        properties = {}
+        for prop in getattr(type_node, 'properties', ()):
+            properties.setdefault(prop.name, prop)
+        signals = {}
+        for signal in getattr(type_node, 'signals', ()):
+            signals.setdefault(signal.name, signal)
+
+        type_node._doc_members = (properties, signals)
+        return type_node._doc_members
+
+    def _resolve_identifier(self, ident):
+        # Types take precedence over symbols
+        try:
+            return self._identifier_cache[ident]
+        except KeyError:
+            pass
+
+        node = self._resolve_type(ident) or self._resolve_symbol(ident)
+        self._identifier_cache[ident] = node
+        return node
 
     def _resolve_implicit_links(self, match):
         match = self.escape(match)
         if not self.resolve_implicit_links:
             return match
 
-        implicit_links = dict({})
-        s = re.split(" |\(|\)", match)
+        # The separators are kept when splitting, so the words are every
+        # other part. Only replacing whole parts never touches a word inside
+        # a longer one, or inside the markup inserted for another word.
+        parts = _IMPLICIT_LINK_SPLIT_RE.split(match)
 
-        for word in s:
-            if not word:
+        implicit_links = {}
+        for word in parts[::2]:
+            if not word or word in implicit_links:
                 continue
-            type_ = self._resolve_type(word)
-            symbol = self._resolve_symbol(word)
-            if type_:
-                implicit_links[word] = self.format_xref(type_, linkname=word)
-            elif symbol:
-                implicit_links[word] = self.format_xref(symbol, linkname=word)
-
-        for word, xref in implicit_links.iteritems():
-            match = match.replace(word, xref)
-        return match
+            node = self._resolve_identifier(word)
+            if node:
+                implicit_links[word] = self.format_xref(node, linkname=word)
+
+        if not implicit_links:
+            return match
+
+        return ''.join([implicit_links.get(part, part) for part in parts])
 
     def _process_other(self, node, match, props):
         return self._resolve_implicit_links(match)
@@ -514,9 +690,10 @@ class DocFormatter(object):
         if type_node is None:
             return match
 
+        properties, signals = self._get_type_members(type_node)
         try:
-            prop = self._find_thing(type_node.properties, props['property_name'])
-        except (AttributeError, KeyError):
+            prop = properties[props['property_name']]
+        except KeyError:
             return match
 
         return self.format_xref(prop, linkname=props['property_name'])
@@ -526,9 +703,10 @@ class DocFormatter(object):
         if type_node is None:
             return match
 
+        properties, signals = self._get_type_members(type_node)
         try:
-            signal = self._find_thing(type_node.signals, props['signal_name'])
-        except (AttributeError, KeyError):
+            signal = signals[props['signal_name']]
+        except KeyError:
             return match
 
         return self.format_xref(signal)
@@ -633,54 +811,34 @@ class DocFormatter(object):
         if self._processing_code:
             return match
 
-        result = ""
+        result = ["</p>"]
         match = match.strip("\n")
         header_level = 0
         while match[header_level] == "#":
             header_level += 1
 
-        result += "</p>"
         while self._opened_sections >= header_level:
-            result += "</section>"
+            result.append("</section>")
             self._opened_sections -= 1
 
         while self._opened_sections < header_level:
-            result += "<section>"
+            result.append("<section>")
             self._opened_sections += 1
 
-        result += "<title>" + props["heading"] + "</title><p>"
-        return result
-
-    def _process_token(self, node, tok):
-        kind, match, props = tok
-
-        dispatch = {
-            'other': self._process_other,
-            'property': self._process_property,
-            'signal': self._process_signal,
-            'type_name': self._process_type_name,
-            'enum_value': self._process_enum_value,
-            'parameter': self._process_parameter,
-            'function_call': self._process_function_call,
-            'code_start': self._process_code_start,
-            'code_start_with_language': self._process_code_start_with_language,
-            'code_end': self._process_code_end,
-            'new_line': self._process_new_line,
-            'new_paragraph': self._process_new_paragraph,
-            'include': self._process_include,
-            'note': self._process_note,
-            'heading': self._process_heading,
-        }
-
-        return dispatch[kind](node, match, props)
+        result.append("<title>" + props["heading"] + "</title><p>")
+        return ''.join(result)
 
     def get_in_parameters(self, node):
         raise NotImplementedError
 
     def format_inline(self, node, para):
-        tokens = self._scanner.scan(para)
-        words = [self._process_token(node, tok) for tok in tokens]
-        return ''.join(words)
+        # Text without any character that can start a markup token is
+        # scanned as a single 'other' token, skip the scanner for it.
+        if _DOC_MARKUP_CHARS_RE.search(para) is None:
+            return self._process_other(node, para, None)
+        dispatch = self._dispatch
+        return ''.join([dispatch[kind](node, match, props)
+                        for kind, match, props in self._scanner.scan(para)])
 
     def format_parameter_name(self, node, parameter):
         if isinstance(parameter.type, ast.Varargs):
@@ -692,6 +850,17 @@ class DocFormatter(object):
         raise NotImplementedError
 
     def format_type(self, type_, link=False):
+        key = (id(type_), link)
+        try:
+            return self._type_cache[key][-1]
+        except KeyError:
+            pass
+
+        formatted = self._format_type(type_, link)
+        self._type_cache[key] = (type_, formatted)
+        return formatted
+
+    def _format_type(self, type_, link=False):
         raise NotImplementedError
 
     def format_page_name(self, node):
@@ -711,6 +880,17 @@ class DocFormatter(object):
             return make_page_id(node)
 
     def format_xref(self, node, pluralize=False, linkname=None, **attrdict):
+        key = (id(node), pluralize, linkname, tuple(sorted(attrdict.items())))
+        try:
+            return self._xref_cache[key][-1]
+        except KeyError:
+            pass
+
+        xref = self._format_xref(node, pluralize, linkname, attrdict)
+        self._xref_cache[key] = (node, xref)
+        return xref
+
+    def _format_xref(self, node, pluralize, linkname, attrdict):
         if node is None or not hasattr(node, 'namespace'):
             attrs = [('xref', 'index')] + attrdict.items()
             return xmlwriter.build_xml_tag('link', attrs, linkname)
@@ -841,9 +1021,30 @@ class DocFormatter(object):
     def to_lower_camel_case(self, string):
         return string[0].lower() + string[1:]
 
-    def add_parent_class(self, parent_type, child_class, classes, is_interface=False):
-        parent = self._transformer.lookup_typenode(parent_type)
-        parent_name = "%s.%s" % (parent.namespace.name, parent.name)
+    def _get_hierarchy_parents(self, node):
+        # The direct parents of a class or interface in the hierarchy, as
+        # (node, is_interface) pairs. Common ancestors show up in the
+        # hierarchy of many classes, so resolve them only once per node.
+        try:
+            return self._hierarchy_parents[id(node)][-1]
+        except KeyError:
+            pass
+
+        parents = []
+        parent = None
+        if node.parent_type:
+            parent = self._lookup_typenode(node.parent_type)
+            parents.append((parent, False))
+        if hasattr(node, "interfaces"):
+            for interface in node.interfaces:
+                if not parent or interface not in parent.interfaces:
+                    parents.append((self._lookup_typenode(interface), True))
+
+        self._hierarchy_parents[id(node)] = (node, parents)
+        return parents
+
+    def add_parent_class(self, parent, child_class, classes, is_interface=False):
+        parent_name = _qname(parent)
         try:
             parent_class = classes[parent_name]
         except KeyError:
@@ -861,53 +1062,61 @@ class DocFormatter(object):
             parent_class.add_parent(parent_interface)
 
     def create_hierarchy_classes(self, node, child_class, classes):
-        name = "%s.%s" % (node.namespace.name, node.name)
-        classes[name] = child_class
-        parent = None
-        if node.parent_type:
-            parent = self._transformer.lookup_typenode(node.parent_type)
-            self.add_parent_class(node.parent_type, child_class, classes)
-        if hasattr(node, "interfaces"):
-            for interface in node.interfaces:
-                if not parent or interface not in parent.interfaces:
-                    self.add_parent_class(interface, child_class, classes,
-                            is_interface=True)
+        classes[_qname(node)] = child_class
+        for parent, is_interface in self._get_hierarchy_parents(node):
+            self.add_parent_class(parent, child_class, classes,
+                    is_interface=is_interface)
         return classes
 
-    def dump_tree(self, klass, xml_string):
-        xml_string += "<item>"
-        xml_string += self.format_xref(klass.node, linkname=klass.name)
+    # The hierarchy is emitted already indented the way utils.indent()
+    # would lay it out, nested in the page at the given level.
+    def dump_tree(self, klass, parts, level):
+        inner = "\n" + "  " * (level + 1)
+        parts.append("<item>")
+        parts.append(inner)
+        parts.append(self.format_xref(klass.node, linkname=klass.name))
         for n in klass.children:
-            xml_string = self.dump_tree(n, xml_string)
-        xml_string += "</item>"
-        return xml_string
-
-    def get_leaves(self, klass, leaves):
-        if not klass.parents:
-            leaves.add(klass)
-        for parent in klass.parents:
-            self.get_leaves(parent, leaves)
+            parts.append(inner)
+            self.dump_tree(n, parts, level + 1)
+        parts.append("\n" + "  " * level)
+        parts.append("</item>")
+
+    def get_leaves(self, klass):
+        # Interfaces give classes several parents, visit each class of the
+        # hierarchy once even when it is reachable through several paths.
+        leaves = set()
+        seen = set([klass])
+        stack = [klass]
+        while stack:
+            klass = stack.pop()
+            if not klass.parents:
+                leaves.add(klass)
+            for parent in klass.parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
         return leaves
 
-    def dump_class(self, klass):
-        leaves = self.get_leaves(klass, leaves=set({}))
+    def dump_class(self, klass, level=0):
+        leaves = self.get_leaves(klass)
         # Needed because the tests are really dumb and use diff :/
         leaves = sorted(leaves, key=lambda leave: getattr(leave, "name"))
-        xml_string = "<tree>"
+        outer = "\n" + "  " * level
+        inner = "\n" + "  " * (level + 1)
+        parts = ["<tree>"]
         while leaves:
             klass = leaves.pop()
-            xml_string = self.dump_tree(klass, xml_string)
-        xml_string += "</tree>"
-        return xml_string
+            parts.append(inner)
+            self.dump_tree(klass, parts, level + 1)
+        parts.append(outer)
+        parts.append("</tree>")
+        parts.append(outer)
+        return "".join(parts)
 
     def dump_class_hierarchy(self, node):
-        name = "%s.%s" % (node.namespace.name, node.name)
-        child_class = HierarchyClass(name, node)
+        child_class = HierarchyClass(_qname(node), node)
         classes = self.create_hierarchy_classes(node, child_class, dict({}))
-        xml_string = self.dump_class(child_class)
-        root = ET.fromstring(xml_string)
-        indent(root, level=2)
-        return ET.tostring(root)
+        return self.dump_class(child_class, level=2)
 
     def format_prerequisites(self, node):
         assert isinstance(node, ast.Interface)
@@ -921,19 +1130,32 @@ class DocFormatter(object):
         else:
             return 'GObject.Object'
 
-    def format_known_implementations(self, node):
-        assert isinstance(node, ast.Interface)
-
-        node_name = node.namespace.name + '.' + node.name
-        impl = []
+    def _get_implementations(self, namespace):
+        # Index the classes of a namespace by the interfaces they implement,
+        # the first time an interface of that namespace is documented.
+        try:
+            return self._implementations[namespace]
+        except KeyError:
+            pass
 
-        for c in node.namespace.itervalues():
+        implementations = {}
+        for c in namespace.itervalues():
             if not isinstance(c, ast.Class):
                 continue
+            seen = set()
             for implemented in c.interfaces:
-                if implemented.target_giname == node_name:
-                    impl.append(c)
-                    break
+                giname = _intern(implemented.target_giname)
+                if giname not in seen:
+                    seen.add(giname)
+                    implementations.setdefault(giname, []).append(c)
+
+        self._implementations[namespace] = implementations
+        return implementations
+
+    def format_known_implementations(self, node):
+        assert isinstance(node, ast.Interface)
+
+        impl = self._get_implementations(node.namespace).get(_qname(node), [])
 
         if len(impl) == 0:
             return 'None'
@@ -956,7 +1178,7 @@ class DocFormatterC(DocFormatter):
         "NULL": "NULL",
     }
 
-    def format_type(self, type_, link=False):
+    def _format_type(self, type_, link=False):
         if isinstance(type_, ast.Array):
             return self.format_type(type_.element_type) + '*'
         elif type_.ctype is not None:
@@ -964,7 +1186,7 @@ class DocFormatterC(DocFormatter):
         elif type_.target_fundamental:
             return type_.target_fundamental
         else:
-            node = self._transformer.lookup_typenode(type_)
+            node = self._lookup_typenode(type_)
             return getattr(node, 'ctype')
 
     def format_function_name(self, func):
@@ -1001,6 +1223,27 @@ class DocFormatterPython(DocFormatterIntrospectableBase):
         "NULL": "None",
     }
 
+    fundamental_types = {
+        "utf8": "unicode",
+        "gunichar": "unicode",
+        "gchar": "str",
+        "guchar": "str",
+        "gboolean": "bool",
+        "gint": "int",
+        "guint": "int",
+        "glong": "int",
+        "gulong": "int",
+        "gint64": "int",
+        "guint64": "int",
+        "gfloat": "float",
+        "gdouble": "float",
+        "gchararray": "str",
+        "GParam": "GLib.Param",
+        "PyObject": "object",
+        "GStrv": "[str]",
+        "GVariant": "GLib.Variant",
+    }
+
     def should_render_node(self, node):
         if getattr(node, "is_constructor", False):
             return False
@@ -1026,29 +1269,9 @@ class DocFormatterPython(DocFormatterIntrospectableBase):
             return parameter.argname
 
     def format_fundamental_type(self, name):
-        fundamental_types = {
-            "utf8": "unicode",
-            "gunichar": "unicode",
-            "gchar": "str",
-            "guchar": "str",
-            "gboolean": "bool",
-            "gint": "int",
-            "guint": "int",
-            "glong": "int",
-            "gulong": "int",
-            "gint64": "int",
-            "guint64": "int",
-            "gfloat": "float",
-            "gdouble": "float",
-            "gchararray": "str",
-            "GParam": "GLib.Param",
-            "PyObject": "object",
-            "GStrv": "[str]",
-            "GVariant": "GLib.Variant"}
-
-        return fundamental_types.get(name, name)
+        return self.fundamental_types.get(name, name)
 
-    def format_type(self, type_, link=False):
+    def _format_type(self, type_, link=False):
         if isinstance(type_, (ast.List, ast.Array)):
             return '[' + self.format_type(type_.element_type) + ']'
         elif isinstance(type_, ast.Map):
@@ -1079,6 +1302,48 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
         "NULL": "null",
     }
 
+    fundamental_types = {
+        "none": "void",
+        "gpointer": "void",
+        "gboolean": "Boolean",
+        "gint8": "Number(gint8)",
+        "guint8": "Number(guint8)",
+        "gint16": "Number(gint16)",
+        "guint16": "Number(guint16)",
+        "gint32": "Number(gint32)",
+        "guint32": "Number(guint32)",
+        "gchar": "Number(gchar)",
+        "guchar": "Number(guchar)",
+        "gshort": "Number(gshort)",
+        "gint": "Number(gint)",
+        "guint": "Number(guint)",
+        "gfloat": "Number(gfloat)",
+        "gdouble": "Number(gdouble)",
+        "utf8": "String",
+        "gunichar": "String",
+        "filename": "String",
+        "GType": "GObject.Type",
+        "GVariant": "GLib.Variant",
+        # These cannot be fully represented in gjs
+        "gsize": "Number(gsize)",
+        "gssize": "Number(gssize)",
+        "gintptr": "Number(gintptr)",
+        "guintptr": "Number(guintptr)",
+        "glong": "Number(glong)",
+        "gulong": "Number(gulong)",
+        "gint64": "Number(gint64)",
+        "guint64": "Number(guint64)",
+        "long double": "Number(long double)",
+        "long long": "Number(long long)",
+        "unsigned long long": "Number(unsigned long long)",
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(DocFormatterGjs, self).__init__(*args, **kwargs)
+        self._gparam_subclass_cache = {}
+        self._struct_simple_cache = {}
+        self._param_skip_cache = {}
+
     def is_method(self, node):
         if getattr(node, "is_method", False):
             return True
@@ -1091,34 +1356,30 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
     def resolve_gboxed_constructor(self, node):
         zero_args_constructor = None
         default_constructor = None
+        first_constructor = None
 
-        introspectable_constructors = \
-            filter(lambda c: getattr(c, 'introspectable', True),
-                   node.constructors)
-        for c in introspectable_constructors:
-            if zero_args_constructor is None and \
-               len(c.parameters) == 0:
+        for c in node.constructors:
+            if not getattr(c, 'introspectable', True):
+                continue
+            if first_constructor is None:
+                first_constructor = c
+            if zero_args_constructor is None and not c.parameters:
                 zero_args_constructor = c
-            if default_constructor is None and \
-               c.name == 'new':
+            if default_constructor is None and c.name == 'new':
                 default_constructor = c
+            if zero_args_constructor is not None and \
+               default_constructor is not None:
+                break
+
         if default_constructor is None:
             default_constructor = zero_args_constructor
-        if default_constructor is None and \
-           len(introspectable_constructors) > 0:
-            default_constructor = introspectable_constructors[0]
+        if default_constructor is None:
+            default_constructor = first_constructor
 
         node.gjs_default_constructor = default_constructor
         node.gjs_zero_args_constructor = zero_args_constructor
 
     def should_render_node(self, node):
-        if isinstance(node, (ast.Compound, ast.Boxed)):
-            self.resolve_gboxed_constructor(node)
-
-        if isinstance(node, ast.Compound) and node.disguised and \
-           len(node.methods) == len(node.static_methods) == len(node.constructors) == 0:
-            return False
-
         if isinstance(node, ast.ErrorQuarkFunction):
             return False
         if isinstance(node, ast.Field):
@@ -1128,70 +1389,54 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
                 return False
         if isinstance(node, ast.Union) and node.name is None:
             return False
-        if isinstance(node, ast.Class):
-            is_gparam_subclass = False
-            if node.parent_type:
-                parent = self._transformer.lookup_typenode(node.parent_type)
-                while parent:
-                    if parent.namespace.name == 'GObject' and \
-                       parent.name == 'ParamSpec':
-                        is_gparam_subclass = True
-                        break
-                    if parent.parent_type is None:
-                        break
-                    parent = self._transformer.lookup_typenode(parent.parent_type)
-            if is_gparam_subclass:
-                return False
+        if isinstance(node, ast.Compound) and node.disguised and \
+           len(node.methods) == len(node.static_methods) == len(node.constructors) == 0:
+            return False
+        if isinstance(node, ast.Class) and self._is_gparam_subclass(node):
+            return False
 
-        return super(DocFormatterGjs, self).should_render_node(node)
+        if not super(DocFormatterGjs, self).should_render_node(node):
+            return False
+
+        # The constructors are only needed by the page of the node itself,
+        # so only look for them once we know it is going to be rendered.
+        if isinstance(node, (ast.Compound, ast.Boxed)):
+            self.resolve_gboxed_constructor(node)
+
+        return True
+
+    def _is_gparam_subclass(self, node):
+        try:
+            return self._gparam_subclass_cache[id(node)][-1]
+        except KeyError:
+            pass
+
+        result = False
+        if node.parent_type:
+            parent = self._lookup_typenode(node.parent_type)
+            if parent:
+                if parent.namespace.name == 'GObject' and \
+                   parent.name == 'ParamSpec':
+                    result = True
+                else:
+                    result = self._is_gparam_subclass(parent)
+
+        self._gparam_subclass_cache[id(node)] = (node, result)
+        return result
 
     def format_fundamental_type(self, name):
-        fundamental_types = {
-            "none": "void",
-            "gpointer": "void",
-            "gboolean": "Boolean",
-            "gint8": "Number(gint8)",
-            "guint8": "Number(guint8)",
-            "gint16": "Number(gint16)",
-            "guint16": "Number(guint16)",
-            "gint32": "Number(gint32)",
-            "guint32": "Number(guint32)",
-            "gchar": "Number(gchar)",
-            "guchar": "Number(guchar)",
-            "gshort": "Number(gshort)",
-            "gint": "Number(gint)",
-            "guint": "Number(guint)",
-            "gfloat": "Number(gfloat)",
-            "gdouble": "Number(gdouble)",
-            "utf8": "String",
-            "gunichar": "String",
-            "filename": "String",
-            "GType": "GObject.Type",
-            "GVariant": "GLib.Variant",
-            # These cannot be fully represented in gjs
-            "gsize": "Number(gsize)",
-            "gssize": "Number(gssize)",
-            "gintptr": "Number(gintptr)",
-            "guintptr": "Number(guintptr)",
-            "glong": "Number(glong)",
-            "gulong": "Number(gulong)",
-            "gint64": "Number(gint64)",
-            "guint64": "Number(guint64)",
-            "long double": "Number(long double)",
-            "long long": "Number(long long)",
-            "unsigned long long": "Number(unsigned long long)"}
-
-        return fundamental_types.get(name, name)
+        return self.fundamental_types.get(name, name)
 
-    def format_type(self, type_, link=False):
+    def _format_type(self, type_, link=False):
+        format_type = self.format_type
         if isinstance(type_, ast.Array) and \
            type_.element_type.target_fundamental in ('gint8', 'guint8'):
             return 'ByteArray'
         elif isinstance(type_, (ast.List, ast.Array)):
-            return 'Array(' + self.format_type(type_.element_type, link) + ')'
+            return 'Array(' + format_type(type_.element_type, link) + ')'
         elif isinstance(type_, ast.Map):
-            return '{%s: %s}' % (self.format_type(type_.key_type, link),
-                                 self.format_type(type_.value_type, link))
+            return '{%s: %s}' % (format_type(type_.key_type, link),
+                                 format_type(type_.value_type, link))
         elif not type_ or type_.target_fundamental == "none":
             return "void"
         elif type_.target_giname is not None:
@@ -1207,7 +1452,7 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
                 if giname.startswith(nsname + '.'):
                     return '<link xref="%s">%s</link>' % (giname, giname)
                 else:
-                    resolved = self._transformer.lookup_typenode(type_)
+                    resolved = self._lookup_typenode(type_)
                     if resolved:
                         return self.format_xref(resolved)
             return giname
@@ -1236,35 +1481,45 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
         return len(node.parameters) > 0 or \
             node.retval.type.target_fundamental != 'none'
 
-    def get_in_parameters(self, node):
-        skip = set()
+    def _classify_params(self, node):
+        # The ids of the parameters hidden from the in and out parameter
+        # lists of node. Both lists are usually wanted for the same node,
+        # so walk the parameters once for the two of them.
+        try:
+            return self._param_skip_cache[id(node)][-1]
+        except KeyError:
+            pass
+
+        in_skip = set()
+        out_skip = set()
         for param in node.parameters:
             if param.direction == ast.PARAM_DIRECTION_OUT:
-                skip.add(param)
+                in_skip.add(id(param))
+            elif param.direction == ast.PARAM_DIRECTION_IN:
+                out_skip.add(id(param))
             if param.closure_name is not None:
-                skip.add(node.get_parameter(param.closure_name))
+                closure = node.get_parameter(param.closure_name)
+                in_skip.add(id(closure))
+                out_skip.add(id(closure))
             if param.destroy_name is not None:
-                skip.add(node.get_parameter(param.destroy_name))
+                destroy = node.get_parameter(param.destroy_name)
+                in_skip.add(id(destroy))
+                out_skip.add(id(destroy))
             if isinstance(param.type, ast.Array) and param.type.length_param_name is not None:
-                skip.add(node.get_parameter(param.type.length_param_name))
+                length = node.get_parameter(param.type.length_param_name)
+                in_skip.add(id(length))
+                out_skip.add(id(length))
 
-        params = []
-        for param in node.parameters:
-            if param not in skip:
-                params.append(param)
-        return params
+        skips = (in_skip, out_skip)
+        self._param_skip_cache[id(node)] = (node, skips)
+        return skips
+
+    def get_in_parameters(self, node):
+        skip = self._classify_params(node)[0]
+        return [param for param in node.parameters if id(param) not in skip]
 
     def get_out_parameters(self, node):
-        skip = set()
-        for param in node.parameters:
-            if param.direction == ast.PARAM_DIRECTION_IN:
-                skip.add(param)
-            if param.closure_name is not None:
-                skip.add(node.get_parameter(param.closure_name))
-            if param.destroy_name is not None:
-                skip.add(node.get_parameter(param.destroy_name))
-            if isinstance(param.type, ast.Array) and param.type.length_param_name is not None:
-                skip.add(node.get_parameter(param.type.length_param_name))
+        skip = self._classify_params(node)[1]
 
         params = []
         if node.retval.type.target_fundamental != 'none':
@@ -1276,9 +1531,8 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
                                       ast.PARAM_DIRECTION_OUT)
             ret_param.doc = node.retval.doc
             params.append(ret_param)
-        for param in node.parameters:
-            if param not in skip:
-                params.append(param)
+        params.extend([param for param in node.parameters
+                       if id(param) not in skip])
 
         if len(params) == 1:
             params[0].argname = 'Returns'
@@ -1313,7 +1567,7 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
                (None, 'none', 'gpointer', 'utf8', 'filename', 'va_list'):
                 return True
 
-            resolved = self._transformer.lookup_typenode(node.type)
+            resolved = self._lookup_typenode(node.type)
             if resolved:
                 if isinstance(resolved, ast.Compound) and node.type.ctype[-1] != '*':
                     return self._struct_is_simple(resolved)
@@ -1324,13 +1578,25 @@ class DocFormatterGjs(DocFormatterIntrospectableBase):
             return True
 
     def _struct_is_simple(self, node):
-        if node.disguised or len(node.fields) == 0:
-            return False
+        try:
+            return self._struct_simple_cache[id(node)][-1]
+        except KeyError:
+            pass
 
-        for f in node.fields:
-            if not self.field_is_writable(f):
-                return False
-        return True
+        # Seed the cache so that a struct reached again while its own
+        # fields are being checked is treated as not simple.
+        self._struct_simple_cache[id(node)] = (node, False)
+
+        result = False
+        if not node.disguised and node.fields:
+            result = True
+            for f in node.fields:
+                if not self.field_is_writable(f):
+                    result = False
+                    break
+
+        self._struct_simple_cache[id(node)] = (node, result)
+        return result
 
     def format_gboxed_constructor(self, node):
         if node.namespace.name == 'GLib' and node.name == 'Variant':
@@ -1371,6 +1637,66 @@ LANGUAGES = {
     "gjs": DocFormatterGjs,
 }
 
+_template_lookups = {}
+
+
+def _get_templates_hash(template_dir):
+    # Mako only recompiles a template whose modification time is newer
+    # than its compiled module, which isn't the case after an upgrade
+    # that keeps the build time modification times. Key the compiled
+    # templates on the contents of the templates instead.
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(template_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.tmpl'):
+                continue
+            path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(path, template_dir))
+            with open(path, 'rb') as fp:
+                digest.update(fp.read())
+    return digest.hexdigest()
+
+
+def _get_template_module_directory(template_dir):
+    # Keep the compiled templates around between runs, so that they are
+    # only compiled again when the templates change.
+    if 'GI_DOCWRITER_DISABLE_CACHE' in os.environ:
+        return tempfile.mkdtemp()
+
+    cachedir = os.environ.get('GI_DOCWRITER_MAKO_CACHE')
+    if not cachedir:
+        cachedir = os.path.join(os.path.expanduser('~'), '.cache',
+                                'g-ir-doc-tool')
+
+    # The compiled templates of each template directory go in a directory
+    # named after it and after the contents of its templates, so that
+    # the installed and the uninstalled templates don't share one.
+    prefix = 'templates-%s-' % (
+        hashlib.sha1(os.path.abspath(template_dir)).hexdigest(), )
+    module_dir = os.path.join(cachedir,
+                              prefix + _get_templates_hash(template_dir))
+
+    if not os.path.isdir(module_dir):
+        try:
+            os.makedirs(module_dir, 0o755)
+        except OSError:
+            # No usable cache directory, compile the templates for
+            # this run only.
+            return tempfile.mkdtemp()
+
+        # The templates changed, so the modules compiled from their
+        # previous contents won't be used again.
+        for filename in os.listdir(cachedir):
+            path = os.path.join(cachedir, filename)
+            if filename.startswith(prefix) and path != module_dir:
+                shutil.rmtree(path, ignore_errors=True)
+    elif not os.access(module_dir, os.W_OK | os.X_OK):
+        # Mako writes the compiled modules next to each other in the
+        # directory, which fails if we can't write to it.
+        return tempfile.mkdtemp()
+    return module_dir
+
 
 class DocWriter(object):
     def __init__(self, transformer, language, markdown_include_paths,
@@ -1391,6 +1717,8 @@ class DocWriter(object):
         self._language = self._formatter.language
 
         self._lookup = self._get_template_lookup()
+        # Templates for this language, by page kind
+        self._template_cache = {}
 
     def _get_template_lookup(self):
         if 'UNINSTALLED_INTROSPECTION_SRCDIR' in os.environ:
@@ -1401,56 +1729,101 @@ class DocWriter(object):
 
         template_dir = os.path.join(srcdir, 'doctemplates')
 
-        return TemplateLookup(directories=[template_dir],
-                              module_directory=tempfile.mkdtemp(),
-                              output_encoding='utf-8')
+        # Share the lookup, and so the compiled templates, between all the
+        # writers using the same templates. The templates don't change
+        # while we run, so don't stat them again on every get_template().
+        try:
+            return _template_lookups[template_dir]
+        except KeyError:
+            pass
+
+        lookup = TemplateLookup(directories=[template_dir],
+                                module_directory=_get_template_module_directory(template_dir),
+                                filesystem_checks=False,
+                                output_encoding='utf-8')
+        _template_lookups[template_dir] = lookup
+        return lookup
 
     def write(self, output):
+        # Resolve the output directory once rather than for every page.
+        self._abs_output = os.path.abspath(output)
+
         try:
-            os.makedirs(output)
+            os.makedirs(self._abs_output)
         except OSError:
             # directory already made
-            pass
+            if not os.path.isdir(self._abs_output):
+                raise
 
-        self._walk_node(output, self._transformer.namespace, [])
-        self._transformer.namespace.walk(lambda node, chain: self._walk_node(output, node, chain))
-
-    def _walk_node(self, output, node, chain):
+        namespace = self._transformer.namespace
+        try:
+            self._walk_node(namespace, [])
+            namespace.walk(self._walk_node)
+        finally:
+            # The id caches hold on to the nodes, don't keep the whole
+            # AST alive once the pages are written.
+            clear_id_caches()
+
+    def _walk_node(self, node, chain):
         if isinstance(node, ast.Function) and node.moved_to is not None:
             return False
-        if self._formatter.should_render_node(node):
-            self._render_node(node, chain, output)
-
-            # hack: fields are not Nodes in the ast, so we don't
-            # see them in the visit. Handle them manually here
-            if isinstance(node, (ast.Compound, ast.Class)):
-                chain.append(node)
-                for f in node.fields:
-                    self._walk_node(output, f, chain)
-                chain.pop()
-            return True
-        return False
+        formatter = self._formatter
+        if not formatter.should_render_node(node):
+            return False
+        self._render_node(node, chain)
+
+        # hack: fields are not Nodes in the ast, so we don't
+        # see them in the visit. Handle them manually here.
+        # Fields have no children to visit, so render them
+        # right away rather than walking them.
+        if isinstance(node, (ast.Compound, ast.Class)):
+            chain.append(node)
+            for f in node.fields:
+                if formatter.should_render_node(f):
+                    self._render_node(f, chain)
+            chain.pop()
+        return True
 
-    def _render_node(self, node, chain, output):
+    def _render_node(self, node, chain):
         namespace = self._transformer.namespace
+        formatter = self._formatter
+        template_cache = self._template_cache
 
         # A bit of a hack...maybe this should be an official API
         node._chain = list(chain)
 
         page_kind = get_node_kind(node)
-        template_name = '%s/%s.tmpl' % (self._language, page_kind)
         page_id = make_page_id(node)
 
-        template = self._lookup.get_template(template_name)
-        result = template.render(namespace=namespace,
-                                 node=node,
-                                 page_id=page_id,
-                                 page_kind=page_kind,
-                                 formatter=self._formatter,
-                                 ast=ast)
-
-        output_file_name = os.path.join(os.path.abspath(output),
-                                        page_id + '.page')
-        fp = open(output_file_name, 'w')
-        fp.write(result)
-        fp.close()
+        try:
+            template = template_cache[page_kind]
+        except KeyError:
+            template_name = '%s/%s.tmpl' % (self._language, page_kind)
+            template = self._lookup.get_template(template_name)
+            template_cache[page_kind] = template
+
+        # Stream the page to a temporary file as it is rendered rather than
+        # building it up in memory first, and only move it into place once
+        # it is complete, so a failing template leaves no truncated page.
+        # The template output is only encoded by render(), so encode it on
+        # the way to the file here.
+        output_file_name = os.path.join(self._abs_output, page_id + '.page')
+        temp_file_name = output_file_name + '.tmp'
+        try:
+            with open(temp_file_name, 'wb') as fp:
+                writer = codecs.getwriter(template.output_encoding)(
+                    fp, template.encoding_errors)
+                context = Context(writer,
+                                  namespace=namespace,
+                                  node=node,
+                                  page_id=page_id,
+                                  page_kind=page_kind,
+                                  formatter=formatter,
+                                  ast=ast)
+                template.render_context(context)
+        except:
+            os.unlink(temp_file_name)
+            raise
+        # On Unix, this would just be os.rename() but Windows
+        # doesn't allow that.
+        shutil.move(temp_file_name, output_file_name)
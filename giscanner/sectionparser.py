@@ -19,8 +19,8 @@
 
 import re
 from . import ast
-from .utils import to_underscores_noprefix, indent
-from xml.etree import ElementTree as ET
+from .utils import to_underscores_noprefix
+from xml.sax.saxutils import escape
 
 
 class SectionsFile(object):
@@ -28,6 +28,9 @@ class SectionsFile(object):
     def __init__(self, sections):
         self.sections = sections
 
+    def __iter__(self):
+        return iter(self.sections)
+
 
 class Section(object):
 
@@ -97,59 +100,59 @@ def parse_sections_file(lines):
     return SectionsFile(sections)
 
 
-def write_sections_file(f, sections_file):
-    result = "<SECTIONS>\n"
-    for section in sections_file.sections:
-        result += "\n<SECTION>\n"
+def write_sections_file(f, sections):
+    # sections can be any iterable, so each section is written out
+    # as soon as it is produced instead of building the whole file first.
+    f.write("<SECTIONS>\n")
+    for section in sections:
+        f.write("  <SECTION>\n")
         if section.file is not None:
-            result += "<FILE>%s</FILE>\n" % (section.file, )
+            f.write("    <FILE>%s</FILE>\n" % (escape(section.file), ))
         if section.title is not None:
-            result += "<TITLE>%s</TITLE>\n" % (section.title, )
+            f.write("    <TITLE>%s</TITLE>\n" % (escape(section.title), ))
         if section.includes is not None:
-            result += "<INCLUDE>%s</INCLUDE>\n" % (section.includes, )
+            f.write("    <INCLUDE>%s</INCLUDE>\n" % (escape(section.includes), ))
 
         is_first_subsection = True
         for subsection in section.subsections:
             if subsection.name is not None:
-                result += "<SUBSECTION %s>\n" % (subsection.name, )
+                f.write("    <SUBSECTION %s>\n" % (escape(subsection.name), ))
             elif not is_first_subsection:
-                result += "\n<SUBSECTION>\n"
+                f.write("    <SUBSECTION>\n")
 
             is_first_subsection = False
 
-            result += "\n<SYMBOLS>\n"
+            f.write("    <SYMBOLS>\n")
             for symbol in subsection.symbols:
-                result += "<SYMBOL>" + symbol + "</SYMBOL>\n"
-            result += "</SYMBOLS>\n"
-        result += "</SECTION>\n"
-    result += "</SECTIONS>\n"
-    root = ET.fromstring(result)
-    indent(root)
-    f.write(ET.tostring(root))
+                f.write("      <SYMBOL>%s</SYMBOL>\n" % (escape(symbol), ))
+            f.write("    </SYMBOLS>\n")
+        f.write("  </SECTION>\n")
+    f.write("</SECTIONS>\n")
 
 
 def generate_sections_file(transformer):
     ns = transformer.namespace
 
-    sections = []
-
     def new_section(file_, title):
         section = Section()
         section.file = file_
         section.title = title
         section.subsections.append(Subsection(None))
-        sections.append(section)
         return section
 
     def append_symbol(section, sym):
         section.subsections[0].symbols.append(sym)
 
+    # The main section comes first, so gather all the functions before
+    # yielding the per-class sections.
     general_section = new_section("main", "Main")
-
     for node in ns.itervalues():
         if isinstance(node, ast.Function):
             append_symbol(general_section, node.symbol)
-        elif isinstance(node, (ast.Class, ast.Interface)):
+    yield general_section
+
+    for node in ns.itervalues():
+        if isinstance(node, (ast.Class, ast.Interface)):
             gtype_name = node.gtype_name
             file_name = to_underscores_noprefix(gtype_name).replace('_', '-').lower()
             section = new_section(file_name, gtype_name)
@@ -162,5 +165,4 @@ def generate_sections_file(transformer):
                 append_symbol(section, meth.symbol)
             for meth in node.constructors:
                 append_symbol(section, meth.symbol)
-
-    return SectionsFile(sections)
+            yield section
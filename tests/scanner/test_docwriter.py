@@ -0,0 +1,62 @@
+import unittest
+import os
+import sys
+import __builtin__
+
+
+os.environ['GI_SCANNER_DISABLE_CACHE'] = '1'
+path = os.getenv('UNINSTALLED_INTROSPECTION_SRCDIR', None)
+assert path is not None
+sys.path.insert(0, path)
+
+# Not correct, but enough to get the tests going uninstalled
+__builtin__.__dict__['DATADIR'] = path
+
+from giscanner import ast
+from giscanner.docwriter import DocFormatterC
+from giscanner.message import MessageLogger
+from giscanner.transformer import Transformer
+
+
+def create_formatter(resolve_implicit_links=True):
+    namespace = ast.Namespace('Regress', '1.0')
+    namespace.append(ast.Class('TestObj', None, ctype='RegressTestObj'))
+    namespace.append(ast.Record('TestObjClass', ctype='RegressTestObjClass'))
+    transformer = Transformer(namespace)
+    return DocFormatterC(transformer, [], online=False, link_to_gtk_doc=False,
+                         resolve_implicit_links=resolve_implicit_links,
+                         sections_file=None)
+
+
+class TestImplicitLinks(unittest.TestCase):
+    def setUp(self):
+        MessageLogger.get(namespace=None)
+        self.formatter = create_formatter()
+
+    def test_disabled(self):
+        formatter = create_formatter(resolve_implicit_links=False)
+        self.assertEqual(formatter.format_inline(None, 'RegressTestObj & x'),
+                         'RegressTestObj &amp; x')
+
+    def test_link_standalone_words(self):
+        self.assertEqual(
+            self.formatter.format_inline(None, 'a RegressTestObj (RegressTestObj)'),
+            'a <link xref="Regress.TestObj">RegressTestObj</link> '
+            '(<link xref="Regress.TestObj">RegressTestObj</link>)')
+
+    def test_word_prefix_of_another(self):
+        # RegressTestObj must not be substituted inside RegressTestObjClass,
+        # nor inside the markup inserted for it.
+        self.assertEqual(
+            self.formatter.format_inline(None, 'RegressTestObj RegressTestObjClass'),
+            '<link xref="Regress.TestObj">RegressTestObj</link> '
+            '<link xref="Regress.TestObjClass">RegressTestObjClass</link>')
+
+    def test_no_links_inside_words(self):
+        self.assertEqual(
+            self.formatter.format_inline(None, 'RegressTestObjFoo xRegressTestObj'),
+            'RegressTestObjFoo xRegressTestObj')
+
+
+if __name__ == '__main__':
+    unittest.main()